@@ -4,8 +4,18 @@ load_dotenv()
 
 # Step 1: Setup GROQ API key
 import os
+import re
+import json
 import base64
-from groq import Groq
+from io import BytesIO
+from PIL import Image, ImageOps
+from groq_client import get_groq_client
+from response_cache import ResponseCache, make_key
+
+try:
+    import ahocorasick  # Optional: pyahocorasick for multi-keyword matching
+except ImportError:
+    ahocorasick = None
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 
@@ -13,54 +23,145 @@ if not GROQ_API_KEY:
     raise ValueError("Error: Missing GROQ_API_KEY. Set it in the environment variables.")
 
 # Step 2: Convert image to base64 format
+# Read size for streaming base64 encoding; a multiple of 3 so chunks encode without padding
+_ENCODE_CHUNK_SIZE = 57 * 1024
+
+# Groq caps base64 image requests at 4 MB; images whose data URL would exceed that are downscaled first
+_MAX_INLINE_DATA_URL_BYTES = 4_000_000 - 64 * 1024  # Margin for the prompt and JSON framing
+_MAX_DATA_URL_PREFIX_LEN = len("data:image/jpeg;base64,")
+_MAX_IMAGE_SIDE = 2048
+
+# Leading magic bytes of the image formats accepted by the vision model
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def _sniff_mime_type(header):
+    """
+    Detects the image MIME type from the first bytes of the file.
+
+    Args:
+    header (bytes): Leading bytes of the image file.
+
+    Returns:
+    str: MIME type, defaulting to "image/jpeg" when unknown.
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return "image/jpeg"
+
+
+def _recompress_image(image_file):
+    """
+    Downscales an image and re-encodes it as JPEG so it fits in an inline request.
+
+    The EXIF orientation is applied to the pixels first, since the JPEG is written without EXIF.
+
+    Args:
+    image_file (file): Open binary image file.
+
+    Returns:
+    bytes: JPEG encoded image.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85, optimize=True)
+    return buffer.getvalue()
+
+
 def encode_image(image_path):   
     """
-    Reads an image file and encodes it into a base64 string.
+    Reads an image file and encodes it into a base64 data URL.
+
+    The file is encoded in fixed-size chunks straight into the output buffer, so no full
+    copy of the raw image bytes is kept in memory. Files too large to send inline are
+    downscaled and recompressed as JPEG first (or sent as-is if Pillow cannot decode them),
+    and http(s) URLs are returned unchanged
+    since the model fetches them itself.
 
     Args:
-    image_path (str): Path to the image file.
+    image_path (str): Path to the image file, or an http(s) URL.
 
     Returns:
-    str: Base64 encoded string of the image.
+    str: Data URL ("data:<mime>;base64,...") of the image, or the given URL.
     """
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Error: Image file '{image_path}' not found.")
+    if image_path.startswith(("https://", "http://")):
+        return image_path
 
-    with open(image_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+    try:
+        image_file = open(image_path, "rb")
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Error: Image file '{image_path}' not found.") from None
+
+    with image_file:
+        image_size = os.fstat(image_file.fileno()).st_size
+        if _MAX_DATA_URL_PREFIX_LEN + 4 * ((image_size + 2) // 3) > _MAX_INLINE_DATA_URL_BYTES:
+            try:
+                jpeg_data = _recompress_image(image_file)
+                return "data:image/jpeg;base64," + base64.b64encode(jpeg_data).decode("ascii")
+            except (OSError, Image.DecompressionBombError) as e:
+                print(f"Could not recompress image, sending the original: {e}")
+                image_file.seek(0)
+
+        chunk = image_file.read(_ENCODE_CHUNK_SIZE)
+        encoded_image = bytearray(f"data:{_sniff_mime_type(chunk)};base64,".encode("ascii"))
+        while chunk:
+            encoded_image += base64.b64encode(chunk)
+            chunk = image_file.read(_ENCODE_CHUNK_SIZE)
     
-    return encoded_image  # Return the correctly encoded image
+    return encoded_image.decode("ascii")  # Return the correctly encoded image
 
 
 # Step 3: Setup Multimodal LLM
-def analyze_image_with_query(query, encoded_image, model="llama-3.2-90b-vision-preview"):
+# Responses keyed by a hash of (model, query, image, history) so repeated turns skip the API call
+_response_cache = ResponseCache(maxsize=512)
+
+
+def analyze_image_with_query(query, encoded_image, model="llama-3.2-90b-vision-preview", history=None):
     """
-    Sends an image and text query to Groq's multimodal LLM.
+    Sends an image and text query to Groq's multimodal LLM, or only the text query when
+    no image is given.
+
+    Successful responses are cached, so an identical query on the same image (and with the
+    same history) is answered without another API call.
 
     Args:
     query (str): The query text.
-    encoded_image (str): Base64 encoded image data.
+    encoded_image (str | None): Data URL or http(s) URL of the image, as returned by encode_image.
     model (str): Model name for analysis.
+    history (list | None): Earlier {"role", "content"} user/assistant turns, oldest first.
 
     Returns:
     str: AI-generated response.
     """
+    history = history or []
+    cache_key = make_key(model, query, encoded_image, json.dumps(history))
+    cached_response = _response_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
     try:
-        client = Groq(api_key=GROQ_API_KEY)  # Explicitly pass API key
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": query},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}},
-                ],
-            }
-        ]
+        client = get_groq_client(GROQ_API_KEY)
+        content = [{"type": "text", "text": query}]
+        if encoded_image:
+            content.append({"type": "image_url", "image_url": {"url": encoded_image}})
+        messages = [*history, {"role": "user", "content": content}]
         chat_completion = client.chat.completions.create(messages=messages, model=model)
         
         # Ensure a valid response exists
         if chat_completion and chat_completion.choices:
-            return chat_completion.choices[0].message.content.strip()
+            response = chat_completion.choices[0].message.content.strip()
+            _response_cache.put(cache_key, response)
+            return response
         else:
             return "Error: No valid response from the model."
 
@@ -69,6 +170,100 @@ def analyze_image_with_query(query, encoded_image, model="llama-3.2-90b-vision-p
 
 
 # Step 4: Symptom Checker
+# Example keyword mapping to (follow-up question, medical information)
+# (can be expanded with a more comprehensive dataset)
+MEDICAL_KEYWORDS = {
+    "headache": (
+        "Do you have any other symptoms like fever or nausea?",
+        "Headaches can be caused by stress, dehydration, or migraines. Drink water and rest.",
+    ),
+    "fever": (
+        "How long have you had the fever? Is it accompanied by chills or sweating?",
+        "Fever is often a sign of infection. Monitor your temperature and stay hydrated.",
+    ),
+    "cough": (
+        "Is your cough dry or productive? Do you have shortness of breath?",
+        "A cough can be due to a cold, flu, or allergies. Rest and drink warm fluids.",
+    ),
+    "chest pain": (
+        "Is the pain sharp or dull? Does it radiate to your arm or jaw?",
+        "Chest pain can indicate heart issues. Seek medical attention immediately.",
+    ),
+    "fatigue": (
+        "Have you been experiencing fatigue for a long time? Do you have trouble sleeping?",
+        "Fatigue can result from lack of sleep, stress, or underlying health conditions.",
+    ),
+    "abdominal pain": (
+        "Where exactly is the pain located? Is it sharp or cramping?",
+        "Abdominal pain can be caused by indigestion, gas, or more serious conditions.",
+    ),
+}
+
+
+def _build_keyword_matcher(keywords):
+    """
+    Compiles the keywords into a single matcher that scans the text once.
+
+    Uses an Aho-Corasick automaton when pyahocorasick is installed and falls back
+    to one compiled regular expression otherwise.
+
+    Args:
+    keywords (dict): Mapping of keyword to its payload.
+
+    Returns:
+    callable: Function taking casefolded text and returning (keyword, payload) of the
+    first match, or None.
+    """
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for keyword, payload in keywords.items():
+            automaton.add_word(keyword.casefold(), (keyword, payload))
+        automaton.make_automaton()
+
+        def match(text):
+            for _, hit in automaton.iter(text):
+                return hit
+            return None
+    else:
+        # Longest keywords first so overlapping alternatives prefer the most specific one
+        ordered = sorted(keywords, key=len, reverse=True)
+        pattern = re.compile("|".join(re.escape(keyword.casefold()) for keyword in ordered))
+        lookup = {keyword.casefold(): (keyword, payload) for keyword, payload in keywords.items()}
+
+        def match(text):
+            hit = pattern.search(text)
+            return lookup[hit.group()] if hit else None
+
+    return match
+
+
+_match_medical_keyword = _build_keyword_matcher(MEDICAL_KEYWORDS)
+
+
+def _follow_up_for(hit):
+    """
+    Builds the symptom checker reply for a keyword match (or None).
+    """
+    if hit:
+        symptom, (question, _) = hit
+        return f"I see you mentioned {symptom}. {question}"
+
+    # If no specific symptom is found, ask a general follow-up question
+    return "Can you describe your symptoms in more detail?"
+
+
+def _medical_info_for(hit):
+    """
+    Builds the medical knowledge reply for a keyword match (or None).
+    """
+    if hit:
+        _, (_, info) = hit
+        return f"Medical Information: {info}"
+
+    # If no match is found, return a generic response
+    return "I recommend consulting a healthcare professional for more detailed information."
+
+
 def symptom_checker(user_input):
     """
     Analyzes the user's input for symptoms and provides follow-up questions or a preliminary diagnosis.
@@ -79,23 +274,8 @@ def symptom_checker(user_input):
     Returns:
     str: Follow-up questions or preliminary diagnosis.
     """
-    # Example symptom mapping (can be expanded with a more comprehensive dataset)
-    symptom_mapping = {
-        "headache": "Do you have any other symptoms like fever or nausea?",
-        "fever": "How long have you had the fever? Is it accompanied by chills or sweating?",
-        "cough": "Is your cough dry or productive? Do you have shortness of breath?",
-        "chest pain": "Is the pain sharp or dull? Does it radiate to your arm or jaw?",
-        "fatigue": "Have you been experiencing fatigue for a long time? Do you have trouble sleeping?",
-        "abdominal pain": "Where exactly is the pain located? Is it sharp or cramping?",
-    }
-
     # Check if any symptom keywords are present in the user's input
-    for symptom, question in symptom_mapping.items():
-        if symptom in user_input.lower():
-            return f"I see you mentioned {symptom}. {question}"
-
-    # If no specific symptom is found, ask a general follow-up question
-    return "Can you describe your symptoms in more detail?"
+    return _follow_up_for(_match_medical_keyword(user_input.casefold()))
 
 
 # Step 5: Fetch Medical Knowledge
@@ -110,22 +290,22 @@ def fetch_medical_knowledge(query):
     str: Relevant medical information.
     """
     # Example: Use a simple placeholder for now (can be replaced with an API call to PubMed or similar)
-    medical_knowledge = {
-        "headache": "Headaches can be caused by stress, dehydration, or migraines. Drink water and rest.",
-        "fever": "Fever is often a sign of infection. Monitor your temperature and stay hydrated.",
-        "cough": "A cough can be due to a cold, flu, or allergies. Rest and drink warm fluids.",
-        "chest pain": "Chest pain can indicate heart issues. Seek medical attention immediately.",
-        "fatigue": "Fatigue can result from lack of sleep, stress, or underlying health conditions.",
-        "abdominal pain": "Abdominal pain can be caused by indigestion, gas, or more serious conditions.",
-    }
-
-    # Check if the query matches any medical knowledge
-    for keyword, info in medical_knowledge.items():
-        if keyword in query.lower():
-            return f"Medical Information: {info}"
+    return _medical_info_for(_match_medical_keyword(query.casefold()))
 
-    # If no match is found, return a generic response
-    return "I recommend consulting a healthcare professional for more detailed information."
+
+# Step 6: Combined triage
+def triage(user_input):
+    """
+    Runs the symptom checker and the medical knowledge lookup with a single scan of the input.
+
+    Args:
+    user_input (str): The user's description of symptoms.
+
+    Returns:
+    tuple: (follow-up question or preliminary diagnosis, relevant medical information).
+    """
+    hit = _match_medical_keyword(user_input.casefold())
+    return _follow_up_for(hit), _medical_info_for(hit)
 
 
 # Example Usage
@@ -0,0 +1,31 @@
+# Shared Groq client
+import threading
+import httpx
+from groq import Groq
+
+# One client per API key, so the HTTP connection pool (and TLS session) is reused across all calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_groq_client(api_key):
+    """
+    Returns the process-wide Groq client for the API key, creating it on first use.
+
+    Args:
+    api_key (str): API key for authentication.
+
+    Returns:
+    Groq: Client backed by a keep-alive HTTP connection pool.
+    """
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                    timeout=30.0,
+                )
+                client = _clients[api_key] = Groq(api_key=api_key, http_client=http_client)
+    return client
@@ -0,0 +1,59 @@
+# In-memory cache for API responses
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Thread-safe, size-bounded LRU cache for API responses.
+
+    Args:
+    maxsize (int): Maximum number of entries kept before the least recently used is evicted.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is not cached.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def make_key(*parts):
+    """
+    Builds a compact cache key by hashing the given parts.
+
+    Args:
+    parts (str | bytes | None): Values identifying the request.
+
+    Returns:
+    bytes: SHA-256 digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b""
+        elif isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.digest()
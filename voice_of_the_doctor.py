@@ -4,23 +4,46 @@ load_dotenv()
 
 # VoiceBot UI with Gradio
 import os
+import importlib.util
+import httpx
 import gradio as gr
 import pygame
 from deep_translator import GoogleTranslator
 from gtts import gTTS
 from elevenlabs.client import ElevenLabs
-import time
+import uuid
+import atexit
+import shutil
+import subprocess
+import threading
 
+from constants import SYSTEM_PROMPT
 from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import record_audio, transcribe_with_groq
+from voice_of_the_patient import record_audio, transcribe_with_groq, AUDIO_NOT_FOUND
 
 # Step 1: Set Up API Key
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 if not ELEVENLABS_API_KEY:
     raise ValueError("ELEVENLABS_API_KEY is missing. Set it as an environment variable or define it directly.")
 
-# Initialize ElevenLabs client
-client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+# Initialize ElevenLabs client on a persistent connection pool (HTTP/2 when the h2 package is installed)
+client = ElevenLabs(
+    api_key=ELEVENLABS_API_KEY,
+    httpx_client=httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=10),
+        timeout=60.0,
+        follow_redirects=True,
+    ),
+    # The SDK overrides the httpx client's timeout per request, so it must be set here too
+    timeout=60.0,
+)
+
+# ElevenLabs voice, model and audio format used for every reply
+# A voice ID rather than a name, so generate() does not list every voice to resolve it on each call
+ELEVENLABS_VOICE = "9BWtsMINqrJLrRacOk9x"  # "Aria"; you can change the voice as needed
+ELEVENLABS_MODEL = "eleven_turbo_v2"  # Use the desired model
+ELEVENLABS_OUTPUT_FORMAT = "mp3_22050_32"  # Small speech-quality MP3; use "mp3_44100_128" for higher fidelity
 
 # Supported languages for gTTS
 GTTS_SUPPORTED_LANGUAGES = {
@@ -41,14 +64,36 @@ GTTS_SUPPORTED_LANGUAGES = {
     "Santali": "hi"  # No direct support, using Hindi
 }
 
-# System prompt for AI response
-system_prompt = """You have to act as a professional doctor. 
-            What's in this image? Do you find anything wrong with it medically? 
-            If you make a differential, suggest some remedies for them. Do not add any numbers or special characters 
-            in your response. Your response should be in one long paragraph. Always answer as if you are speaking 
-            to a real person. Do not say 'In the image I see' but say 'With what I see, I think you have ...' 
-            Do not respond as an AI model or in markdown, your answer should mimic that of an actual doctor. 
-            Keep your answer concise (max 2 sentences). No preamble, start your answer right away."""
+# Codes offered by the UIs that deep_translator only knows under a regional variant
+_TRANSLATOR_LANGUAGE_ALIASES = {"zh": "zh-CN"}
+
+# GoogleTranslator keeps per-request state on the instance, so translators are cached per thread
+_translators = threading.local()
+
+
+def _get_translator(target_lang):
+    """
+    Return a cached GoogleTranslator for the target language.
+    """
+    translators = getattr(_translators, "by_target", None)
+    if translators is None:
+        translators = _translators.by_target = {}
+    if target_lang not in translators:
+        translators[target_lang] = GoogleTranslator(source="auto", target=target_lang)
+    return translators[target_lang]
+
+
+def translate_text(text, target_lang):
+    """
+    Translate text into the target language, skipping the request when it is English.
+
+    target_lang is passed to deep_translator as given (codes such as "zh-CN" are case-sensitive,
+    language names must be lowercase).
+    """
+    if target_lang.lower() in ("en", "english"):
+        return text
+    target_lang = _TRANSLATOR_LANGUAGE_ALIASES.get(target_lang, target_lang)
+    return _get_translator(target_lang).translate(text)
 
 
 def text_to_speech_with_gtts(input_text, output_filepath, lang="en"):
@@ -56,61 +101,165 @@ def text_to_speech_with_gtts(input_text, output_filepath, lang="en"):
     Convert text to speech using gTTS (Google Text-to-Speech).
     """
     lang_code = GTTS_SUPPORTED_LANGUAGES.get(lang, "en")  # Default to English if not found
-    temp_filepath = f"{output_filepath}_{int(time.time())}.mp3"  # Generate unique filename
+    temp_filepath = f"{output_filepath}_{uuid.uuid4().hex}.mp3"  # Generate unique filename
     audioobj = gTTS(text=input_text, lang=lang_code, slow=False)
     audioobj.save(temp_filepath)
     play_audio(temp_filepath)
     return temp_filepath  # Return the new file path
 
 
+# Audio output is shared (pygame.mixer.music and the ffplay stream), so concurrent replies play one at a time
+_playback_lock = threading.Lock()
+
+
+def _start_stream_player():
+    """
+    Start ffplay reading MP3 data from stdin, so playback can begin before the whole clip arrives.
+
+    Returns:
+    subprocess.Popen | None: The player process, or None if ffplay is not available.
+    """
+    ffplay = shutil.which("ffplay")
+    if not ffplay:
+        return None
+    try:
+        return subprocess.Popen(
+            [ffplay, "-nodisp", "-autoexit", "-loglevel", "quiet", "-i", "-"],
+            stdin=subprocess.PIPE,
+            bufsize=0,  # Hand each chunk to the player immediately
+        )
+    except OSError as e:
+        print(f"Could not start streaming playback: {e}")
+        return None
+
+
+def _close_stream_player(player, finished):
+    """
+    Let ffplay play out the rest of the stream (or stop it if the stream failed) and reap the process.
+    """
+    try:
+        if finished:
+            player.stdin.close()
+        else:
+            player.kill()
+    except OSError:
+        pass
+    player.wait()  # Wait for the audio to finish playing
+
+
 def text_to_speech_with_elevenlabs(input_text, output_filepath):
     """
     Convert text to speech using ElevenLabs API.
+
+    Audio chunks are played as they arrive (through ffplay, when installed and no other
+    reply is playing) while also being written to the output file. Otherwise the audio is
+    downloaded without waiting for the audio output and played once it is free.
     """
     try:
         input_text = input_text.encode("utf-8").decode("utf-8")  # Ensure UTF-8 encoding
         print(f"Generating audio for text: {input_text}")
         
-        # Generate audio using ElevenLabs API
+        # Stream audio from the ElevenLabs API
         audio_stream = client.generate(
             text=input_text,
-            voice="Aria",  # You can change the voice as needed
-            model="eleven_turbo_v2"  # Use the desired model
+            voice=ELEVENLABS_VOICE,
+            model=ELEVENLABS_MODEL,
+            output_format=ELEVENLABS_OUTPUT_FORMAT,
+            stream=True
         )
         
-        temp_filepath = f"{output_filepath}_{int(time.time())}.mp3"  # Generate unique filename
+        temp_filepath = f"{output_filepath}_{uuid.uuid4().hex}.mp3"  # Generate unique filename
         
         # Check if audio_stream is a generator
-        if hasattr(audio_stream, "__iter__"):
-            print("Audio stream is a generator. Writing to file...")
+        if not hasattr(audio_stream, "__iter__"):
+            print("No audio data received from ElevenLabs API.")
+            return None
+
+        print("Audio stream is a generator. Writing to file...")
+        # Only stream into ffplay when the audio output is free, so a busy output never holds up the download
+        player = None
+        if _playback_lock.acquire(blocking=False):
+            player = _start_stream_player()
+            if player is None:
+                _playback_lock.release()
+        streaming = player is not None
+        completed = False
+        try:
             with open(temp_filepath, "wb") as f:
                 for chunk in audio_stream:
                     if chunk:
                         f.write(chunk)  # Write each chunk to the file
+                        if streaming:
+                            try:
+                                player.stdin.write(chunk)  # Feed the player as the audio arrives
+                            except OSError:
+                                streaming = False
+            completed = True
             print(f"Audio saved to {temp_filepath}")
-        else:
-            print("No audio data received from ElevenLabs API.")
-            return None
+        finally:
+            if player:
+                try:
+                    _close_stream_player(player, finished=completed and streaming)
+                finally:
+                    _playback_lock.release()
         
-        # Play the audio
-        play_audio(temp_filepath)
+        # Play the audio if it could not be streamed
+        if not streaming:
+            play_audio(temp_filepath)
         return temp_filepath  # Return the new file path
     except Exception as e:
         print(f"Error using ElevenLabs API: {e}")
         return None
 
 
+# How often play_audio checks whether the clip has finished
+_PLAYBACK_POLL_MS = 100
+
+
+def _init_mixer():
+    """
+    Initialize the pygame mixer once; it is kept open and reused for every playback.
+
+    Returns:
+    bool: True if the mixer is ready.
+    """
+    if pygame.mixer.get_init():
+        return True
+    try:
+        pygame.mixer.init(buffer=1024)
+        return True
+    except pygame.error as e:
+        print(f"Could not initialize the audio mixer: {e}")
+        return False
+
+
+_init_mixer()
+atexit.register(pygame.mixer.quit)
+
+
+def _wait_for_playback():
+    """
+    Block until the current music clip has finished playing.
+
+    Playback runs on worker threads, where SDL events cannot be pumped, so this sleeps
+    between get_busy() checks instead of waiting on an end event.
+    """
+    while pygame.mixer.music.get_busy():
+        pygame.time.wait(_PLAYBACK_POLL_MS)
+
+
 def play_audio(output_filepath):
     """
     Play the audio file using pygame.
     """
     try:
-        pygame.mixer.init()
-        pygame.mixer.music.load(output_filepath)
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():  # Wait for the audio to finish playing
-            pygame.time.Clock().tick(10)
-        pygame.mixer.quit()  # Unload mixer after playback
+        if not _init_mixer():  # Retry in case no audio device was available at import
+            return
+        with _playback_lock:
+            pygame.mixer.music.load(output_filepath)
+            pygame.mixer.music.play()
+            _wait_for_playback()  # Wait for the audio to finish playing
+            pygame.mixer.music.unload()  # Release the file but keep the mixer open
     except Exception as e:
         print(f"An error occurred while trying to play the audio: {e}")
 
@@ -118,8 +267,8 @@ def play_audio(output_filepath):
 def process_inputs(audio_filepath, image_filepath, language):
     """Processes user input, transcribes audio, analyzes image, translates response, and generates speech output."""
     
-    # Ensure the audio file exists
-    if audio_filepath is None or not os.path.exists(audio_filepath):
+    # Ensure an audio file is provided
+    if audio_filepath is None:
         return "No audio file provided", "No doctor response", None
 
     # Transcribe audio
@@ -130,18 +279,28 @@ def process_inputs(audio_filepath, image_filepath, language):
     speech_to_text_output = transcribe_with_groq(GROQ_API_KEY=GROQ_API_KEY, 
                                                  audio_filepath=audio_filepath,
                                                  stt_model="whisper-large-v3")
+    if speech_to_text_output == AUDIO_NOT_FOUND:
+        return "No audio file provided", "No doctor response", None
 
     # Handle image analysis
     doctor_response = "No image provided for me to analyze."
-    if image_filepath and os.path.exists(image_filepath):
-        encoded_image = encode_image(image_filepath)
-        doctor_response = analyze_image_with_query(query=system_prompt + " " + speech_to_text_output,
+    encoded_image = None
+    if image_filepath:
+        try:
+            encoded_image = encode_image(image_filepath)
+        except FileNotFoundError as e:
+            print(e)
+    if encoded_image:
+        doctor_response = analyze_image_with_query(query=f"{SYSTEM_PROMPT} {speech_to_text_output}",
                                                    encoded_image=encoded_image,
                                                    model="llama-3.2-11b-vision-preview")
 
     # Translate and generate speech output
     if language != "English":
-        doctor_response = GoogleTranslator(source='auto', target=language.lower()).translate(doctor_response)
+        try:
+            doctor_response = translate_text(doctor_response, target_lang=language.lower())
+        except Exception as e:
+            print(f"Error in translation: {e}")  # Fall back to the untranslated response
         audio_file = text_to_speech_with_gtts(input_text=doctor_response, output_filepath="final", lang=language)
     else:
         audio_file = text_to_speech_with_elevenlabs(input_text=doctor_response, output_filepath="final")
@@ -5,11 +5,23 @@ load_dotenv()
 # Step 1: Setup Audio Recorder (Requires ffmpeg & portaudio)
 import logging
 import os
+import wave
+import numpy as np
 import speech_recognition as sr
 from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from groq import Groq
+from groq_client import get_groq_client
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from response_cache import ResponseCache, make_key
+
+try:
+    import lameenc  # Optional: in-process MP3 encoder
+except ImportError:
+    lameenc = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -36,9 +48,21 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
             logging.info("Recording complete.")
 
             # Convert recorded audio to MP3
-            wav_data = audio_data.get_wav_data()
-            audio_segment = AudioSegment.from_wav(BytesIO(wav_data))
-            audio_segment.export(file_path, format="mp3", bitrate="128k")
+            if lameenc is not None:
+                # Encode the raw 16-bit PCM in-process: no WAV container and no ffmpeg subprocess
+                encoder = lameenc.Encoder()
+                encoder.set_bit_rate(128)
+                encoder.set_in_sample_rate(audio_data.sample_rate)
+                encoder.set_channels(1)
+                encoder.set_quality(2)
+                mp3_data = encoder.encode(audio_data.get_raw_data(convert_width=2))
+                mp3_data += encoder.flush()
+                with open(file_path, "wb") as audio_file:
+                    audio_file.write(mp3_data)
+            else:
+                wav_data = audio_data.get_wav_data()
+                audio_segment = AudioSegment.from_wav(BytesIO(wav_data))
+                audio_segment.export(file_path, format="mp3", bitrate="128k")
 
             logging.info(f"Audio saved to {file_path}")
 
@@ -53,10 +77,95 @@ GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if not GROQ_API_KEY:
     logging.error("GROQ_API_KEY is missing! Set it in the environment variables.")
 
+# Returned by transcribe_with_groq when the audio file does not exist, so callers can tell it from a transcript
+AUDIO_NOT_FOUND = "Error: Audio file not found."
+
+# Transcripts keyed by a hash of (model, language, audio bytes), so resubmitting a clip skips the upload
+_transcription_cache = ResponseCache(maxsize=256)
+
+# Clips longer than this are split at pauses and the segments transcribed in parallel
+_STT_SEGMENT_MS = 15000
+_SEGMENTED_STT_MIN_MS = 2 * _STT_SEGMENT_MS
+_STT_SILENCE_SEEK_MS = 10
+_STT_MAX_WORKERS = 4
+
+def _estimate_duration_ms(audio_data):
+    """
+    Estimates the clip duration without decoding the audio.
+
+    Args:
+    audio_data (bytes): Encoded audio clip.
+
+    Returns:
+    int: Duration in milliseconds, read from the WAV header or, for other formats,
+    estimated from the size assuming the 128 kbps MP3 written by record_audio.
+    """
+    try:
+        with wave.open(BytesIO(audio_data)) as wav_file:
+            return wav_file.getnframes() * 1000 // wav_file.getframerate()
+    except (wave.Error, EOFError):
+        return len(audio_data) * 8 // 128  # 128 kbps = 128 bits per millisecond
+
+def _pause_aligned_spans(pause_midpoints, duration_ms, segment_ms):
+    """
+    Cuts a clip into contiguous spans of at most segment_ms, preferring cuts at pauses.
+
+    Args:
+    pause_midpoints (list): Candidate cut points (ms), in increasing order.
+    duration_ms (int): Length of the clip in milliseconds.
+    segment_ms (int): Maximum span length in milliseconds.
+
+    Returns:
+    list: (start, end) spans covering the whole clip, in order.
+    """
+    spans = []
+    start = 0
+    candidate = None
+    for point in pause_midpoints + [duration_ms]:
+        while point - start > segment_ms:
+            # Cut at the latest pause that keeps the span short enough, or at a fixed interval
+            # when the speech has no usable pause
+            cut = candidate if candidate is not None and candidate > start else start + segment_ms
+            spans.append((start, cut))
+            start = cut
+            candidate = None
+        candidate = point
+    spans.append((start, duration_ms))
+    return spans
+
+def _split_on_pauses(audio_data, segment_ms=_STT_SEGMENT_MS):
+    """
+    Splits audio into contiguous WAV segments of at most segment_ms, cutting at pauses where possible.
+
+    Args:
+    audio_data (bytes): Encoded audio clip.
+    segment_ms (int): Maximum segment length in milliseconds.
+
+    Returns:
+    list: WAV encoded segments in playback order, together covering the whole clip.
+    """
+    audio = AudioSegment.from_file(BytesIO(audio_data))
+    speech_ranges = detect_nonsilent(audio, min_silence_len=500, silence_thresh=audio.dBFS - 16,
+                                     seek_step=_STT_SILENCE_SEEK_MS)
+
+    # Cut in the middle of pauses so no audio (including quiet speech) is dropped between segments
+    pause_midpoints = [(previous_end + next_start) // 2
+                       for (_, previous_end), (next_start, _) in zip(speech_ranges, speech_ranges[1:])]
+
+    segments = []
+    for start, end in _pause_aligned_spans(pause_midpoints, len(audio), segment_ms):
+        buffer = BytesIO()
+        audio[start:end].export(buffer, format="wav")
+        segments.append(buffer.getvalue())
+    return segments
+
 def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, language="auto"):
     """
     Transcribes audio using Groq API.
 
+    Results are cached by the audio content, so the same clip is only uploaded once.
+    Long clips are split at pauses and the segments are transcribed in parallel.
+
     Args:
     stt_model (str): Speech-to-text model name.
     audio_filepath (str): Path to the recorded audio file.
@@ -66,30 +175,169 @@ def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, language="auto
     Returns:
     str: Transcribed text or error message.
     """
-    if not os.path.exists(audio_filepath):
+    try:
+        with open(audio_filepath, "rb") as audio_file:
+            audio_data = audio_file.read()
+    except FileNotFoundError:
         logging.error("Audio file not found!")
-        return "Error: Audio file not found."
+        return AUDIO_NOT_FOUND
 
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        with open(audio_filepath, "rb") as audio_file:
+        cache_key = make_key(stt_model, language, audio_data)
+        cached_text = _transcription_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
+        client = get_groq_client(GROQ_API_KEY)
+
+        segments = []
+        if _estimate_duration_ms(audio_data) > _SEGMENTED_STT_MIN_MS:
+            try:
+                segments = _split_on_pauses(audio_data)
+            except Exception as e:
+                # Splitting is only a speed-up; send the whole clip if it cannot be decoded
+                logging.error(f"Error splitting audio, transcribing it in one request: {e}")
+
+        text = None
+        if len(segments) > 1:
+            def transcribe_segment(numbered_segment):
+                index, segment = numbered_segment
+                return client.audio.transcriptions.create(
+                    model=stt_model,
+                    file=(f"segment_{index}.wav", segment),
+                    language=language
+                ).text.strip()
+
+            try:
+                with ThreadPoolExecutor(max_workers=min(_STT_MAX_WORKERS, len(segments))) as executor:
+                    texts = list(executor.map(transcribe_segment, enumerate(segments)))
+                text = " ".join(segment_text for segment_text in texts if segment_text)
+            except Exception as e:
+                # Like a failed split, a failed segment falls back to the whole clip in one request
+                logging.error(f"Error transcribing segments, transcribing the clip in one request: {e}")
+
+        if text is None:
             transcription = client.audio.transcriptions.create(
                 model=stt_model,
-                file=audio_file,
+                file=(os.path.basename(audio_filepath), audio_data),
                 language=language
             )
+            if not transcription:
+                return "Error: No transcription result."
+            text = transcription.text
 
-        return transcription.text if transcription else "Error: No transcription result."
+        _transcription_cache.put(cache_key, text)
+        return text
     
     except Exception as e:
         logging.error(f"Error during transcription: {e}")
         return "Error: Failed to transcribe audio."
 
 # Step 3: Emotion Detection
+# Shared session so emotion requests reuse pooled keep-alive connections
+_emotion_session = requests.Session()
+_emotion_session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=3, backoff_factor=0.2)),
+)
+# Connect/read timeout (seconds) for emotion API requests, so a stalled API cannot block the turn
+_EMOTION_API_TIMEOUT = (5, 15)
+# Detected emotions keyed by a hash of the audio bytes
+_emotion_cache = ResponseCache(maxsize=256)
+
+# Optional local emotion classifier: an ONNX model mapping the mean of 20 MFCCs (shape [1, 20])
+# to one logit per label. The remote API is only used when its confidence is below the threshold.
+EMOTION_MODEL_PATH = os.environ.get("EMOTION_MODEL_PATH")
+EMOTION_MODEL_LABELS = os.environ.get("EMOTION_MODEL_LABELS", "neutral,happy,sad,angry,fearful").split(",")
+_LOCAL_EMOTION_MIN_CONFIDENCE = 0.5
+_LOCAL_EMOTION_SAMPLE_RATE = 16000
+
+
+# librosa is only imported (by _load_emotion_model) when a local emotion model is configured
+librosa = None
+
+
+def _emotion_probabilities(session, samples):
+    """
+    Runs the local emotion model on mono audio samples.
+
+    Args:
+    session (onnxruntime.InferenceSession): The loaded emotion model.
+    samples (numpy.ndarray): Float32 samples at _LOCAL_EMOTION_SAMPLE_RATE.
+
+    Returns:
+    numpy.ndarray: Probability per label.
+    """
+    mfcc = librosa.feature.mfcc(y=samples, sr=_LOCAL_EMOTION_SAMPLE_RATE, n_mfcc=20).mean(axis=1)
+    input_name = session.get_inputs()[0].name
+    logits = session.run(None, {input_name: mfcc[None].astype(np.float32)})[0][0]
+
+    probabilities = np.exp(logits - logits.max())
+    return probabilities / probabilities.sum()
+
+
+def _load_emotion_model():
+    """
+    Loads and warms up the local emotion model once, if one is configured.
+
+    Returns:
+    onnxruntime.InferenceSession: The model session, or None if unavailable.
+    """
+    global librosa
+    if not EMOTION_MODEL_PATH:
+        return None
+    try:
+        import librosa as librosa_module  # Optional: MFCC features for the local emotion model
+        import onnxruntime  # Optional: runs the local emotion model
+    except ImportError:
+        logging.error("EMOTION_MODEL_PATH is set but librosa/onnxruntime are not installed.")
+        return None
+    librosa = librosa_module
+
+    try:
+        session = onnxruntime.InferenceSession(EMOTION_MODEL_PATH, providers=["CPUExecutionProvider"])
+        # The first MFCC call JIT-compiles librosa's numba kernels; pay that here, not on a user request
+        _emotion_probabilities(session, np.zeros(_LOCAL_EMOTION_SAMPLE_RATE, dtype=np.float32))
+        return session
+    except Exception as e:
+        logging.error(f"Error loading emotion model: {e}")
+        return None
+
+_emotion_model = _load_emotion_model()
+
+
+def _detect_emotion_locally(audio_data):
+    """
+    Classifies the emotion of an audio clip with the local model.
+
+    Args:
+    audio_data (bytes): Encoded audio clip.
+
+    Returns:
+    tuple: (emotion, confidence), or (None, 0.0) if the clip could not be classified.
+    """
+    try:
+        audio = AudioSegment.from_file(BytesIO(audio_data))
+        audio = audio.set_channels(1).set_frame_rate(_LOCAL_EMOTION_SAMPLE_RATE)
+        samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+        samples /= float(1 << (8 * audio.sample_width - 1))
+
+        probabilities = _emotion_probabilities(_emotion_model, samples)
+        best = int(probabilities.argmax())
+        return EMOTION_MODEL_LABELS[best], float(probabilities[best])
+    except Exception as e:
+        logging.error(f"Error during local emotion detection: {e}")
+        return None, 0.0
+
+
 def detect_emotion(audio_filepath):
     """
     Detects the emotion from the user's voice using an emotion detection API.
 
+    When a local model is configured (EMOTION_MODEL_PATH), it is tried first and the API is
+    only called if the model is not confident. Results are cached by the audio content,
+    so the same clip is only classified once.
+
     Args:
     audio_filepath (str): Path to the audio file.
 
@@ -100,21 +348,40 @@ def detect_emotion(audio_filepath):
     API_KEY = os.environ.get("EMOTION_API_KEY")  # Set your API key in .env
     API_URL = "https://api.example.com/emotion-detection"  # Replace with actual API URL
 
-    if not API_KEY:
-        return "neutral"  # Fallback if no API key is provided
+    if not API_KEY and _emotion_model is None:
+        return "neutral"  # Fallback if no API key or local model is provided
 
     try:
-        # Send the audio file to the emotion detection API
         with open(audio_filepath, "rb") as audio_file:
-            response = requests.post(
-                API_URL,
-                headers={"Authorization": f"Bearer {API_KEY}"},
-                files={"file": audio_file},
-            )
+            audio_data = audio_file.read()
+
+        cache_key = make_key(audio_data)
+        cached_emotion = _emotion_cache.get(cache_key)
+        if cached_emotion is not None:
+            return cached_emotion
+
+        # Try the local model first; no network round-trip when it is confident
+        if _emotion_model is not None:
+            emotion, confidence = _detect_emotion_locally(audio_data)
+            if emotion and confidence >= _LOCAL_EMOTION_MIN_CONFIDENCE:
+                _emotion_cache.put(cache_key, emotion)
+                return emotion
+
+        if not API_KEY:
+            return "neutral"
+
+        # Send the audio file to the emotion detection API
+        response = _emotion_session.post(
+            API_URL,
+            headers={"Authorization": f"Bearer {API_KEY}"},
+            files={"file": (os.path.basename(audio_filepath), audio_data)},
+            timeout=_EMOTION_API_TIMEOUT,
+        )
         
         # Parse the API response
         if response.status_code == 200:
             emotion = response.json().get("emotion", "neutral")
+            _emotion_cache.put(cache_key, emotion)
             return emotion
         else:
             logging.error(f"Error: Emotion detection API returned status code {response.status_code}")